@@ -0,0 +1,105 @@
+"""
+TorchScript Export Utility
+Converts a trained checkpoint into a frozen TorchScript artifact once,
+so inference workers can skip timm model assembly at startup
+
+Usage:
+    python export_torchscript.py [model_path] [--encrypt] [--onnx]
+
+Run it on the deployment device type: frozen graphs are device specific
+(the device and INT8 mode are part of the artifact name, e.g. best_model.cpu.int8.ptc).
+--onnx additionally writes best_model.onnx for ONNX Runtime (USE_ONNX=1).
+"""
+
+import io
+import os
+import sys
+import torch
+from inference import DEVICE, load_model
+from model_optimizer import (
+    CHECKPOINT_DIGEST_KEY,
+    export_onnx,
+    file_digest,
+    get_onnx_path,
+    get_scripted_path,
+    quantize_for_cpu,
+    script_model
+)
+
+
+def save_artifact(data, path, encrypt):
+    """Write serialized model bytes, encrypted with the model key if requested"""
+    if encrypt:
+        from model_encryption import ModelEncryption
+
+        encryptor = ModelEncryption(os.getenv('MODEL_KEY_PATH', './secrets/model.key'))
+        return encryptor.encrypt_data(data, path + '.encrypted')
+
+    with open(path, 'wb') as f:
+        f.write(data)
+    return path
+
+
+def export_torchscript_model(model_path, encrypt=False):
+    """
+    Quantize (CPU) + script + freeze a checkpoint and save it
+
+    Args:
+        model_path: Path to original .pth checkpoint
+        encrypt: Save as <name>.<device>[.int8].ptc.encrypted for the secure server
+    """
+    print(f"⚙️  Exporting TorchScript model: {model_path} ({DEVICE.type})")
+
+    model, info = load_model(model_path, DEVICE)
+    scripted = script_model(quantize_for_cpu(model, DEVICE))
+
+    # Serialize in memory so an encrypted export never writes the plain module;
+    # the checkpoint digest lets loaders detect a stale artifact
+    buffer = io.BytesIO()
+    torch.jit.save(scripted, buffer, _extra_files={CHECKPOINT_DIGEST_KEY: file_digest(model_path)})
+    scripted_path = save_artifact(buffer.getvalue(), get_scripted_path(model_path, DEVICE), encrypt)
+
+    print(f"✅ TorchScript model saved: {scripted_path}")
+    print(f"   Epoch: {info['epoch']}")
+
+    return scripted_path
+
+
+def export_onnx_model(model_path, encrypt=False):
+    """
+    Export a checkpoint to ONNX (eager FP32 graph; TensorRT builds FP16 engines)
+
+    Args:
+        model_path: Path to original .pth checkpoint
+        encrypt: Save as <name>.onnx.encrypted for the secure server
+    """
+    print(f"⚙️  Exporting ONNX model: {model_path}")
+
+    model, info = load_model(model_path, DEVICE)
+
+    buffer = io.BytesIO()
+    export_onnx(model, buffer, file_digest(model_path))
+    onnx_path = save_artifact(buffer.getvalue(), get_onnx_path(model_path), encrypt)
+
+    print(f"✅ ONNX model saved: {onnx_path}")
+
+    return onnx_path
+
+
+def main():
+    args = [arg for arg in sys.argv[1:] if not arg.startswith('--')]
+    model_path = args[0] if args else './saved_models/best_model.pth'
+
+    if not os.path.exists(model_path):
+        print(f"❌ Model not found: {model_path}")
+        sys.exit(1)
+
+    encrypt = '--encrypt' in sys.argv
+    export_torchscript_model(model_path, encrypt=encrypt)
+
+    if '--onnx' in sys.argv:
+        export_onnx_model(model_path, encrypt=encrypt)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""
+Image Utilities
+Image decoding shared by the inference CLI and server
+(JPEG header parsing, reduced-resolution JPEG decode, resize interpolation)
+"""
+
+import os
+import struct
+
+# Start-of-frame markers (baseline, progressive, ...); C4/C8/CC are not frames
+JPEG_SOF_MARKERS = frozenset(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+
+
+def read_jpeg_size(image_path):
+    """
+    (height, width) from the JPEG frame header without decoding, or None
+    if the file is not a JPEG (extensions are not trusted)
+    """
+    try:
+        with open(image_path, 'rb') as f:
+            if f.read(2) != b'\xff\xd8':
+                return None
+
+            while True:
+                marker = f.read(2)
+                if len(marker) < 2 or marker[0] != 0xFF:
+                    return None
+
+                # Fill byte: the real marker code follows
+                if marker[1] == 0xFF:
+                    f.seek(-1, os.SEEK_CUR)
+                    continue
+
+                # Standalone markers carry no length
+                if marker[1] == 0x01 or 0xD0 <= marker[1] <= 0xD7:
+                    continue
+
+                (length,) = struct.unpack('>H', f.read(2))
+                if marker[1] in JPEG_SOF_MARKERS:
+                    _, height, width = struct.unpack('>BHH', f.read(5))
+                    return height, width
+
+                f.seek(length - 2, os.SEEK_CUR)
+    except (OSError, struct.error):
+        return None
+
+
+def read_image(image_path, img_size):
+    """
+    Decode an image as BGR. JPEGs are decoded in the DCT domain
+    (libjpeg-turbo) at the largest 1/8, 1/4 or 1/2 reduction that keeps the
+    short side at least 2x the model input; the factor comes from the
+    header, so each file is decoded only once.
+    """
+    import cv2  # deferred: keeps CLI startup/error paths fast
+    size = read_jpeg_size(image_path)
+    if size is not None:
+        reductions = (
+            (8, cv2.IMREAD_REDUCED_COLOR_8),
+            (4, cv2.IMREAD_REDUCED_COLOR_4),
+            (2, cv2.IMREAD_REDUCED_COLOR_2)
+        )
+        for factor, flag in reductions:
+            if min(size) // factor >= 2 * img_size:
+                img = cv2.imread(image_path, flag)
+                if img is not None:
+                    return img
+                break
+
+    return cv2.imread(image_path)
+
+
+def get_interpolation(img, img_size):
+    """INTER_AREA when shrinking, INTER_LINEAR when enlarging"""
+    import cv2
+    if img.shape[0] > img_size or img.shape[1] > img_size:
+        return cv2.INTER_AREA
+    return cv2.INTER_LINEAR
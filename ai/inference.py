@@ -5,16 +5,40 @@ CRITICAL FIXES:
 2. Uses TIMM (not torchvision)
 3. Recreates EXACT classifier architecture
 4. Proper error handling
+
+DEVELOPMENT ONLY: every invocation pays Python startup, torch import and
+model load. Production traffic goes through inference_server.py --server-mode.
 """
 
 import sys
 import json
 import os
-import cv2
+import bisect
 import torch
 import torch.nn as nn
 import numpy as np
 import warnings
+from concurrent.futures import ThreadPoolExecutor
+from image_utils import get_interpolation, read_image
+from model_loader import load_weights_only
+from model_optimizer import (
+    USE_ONNX,
+    allocate_input_buffer,
+    allocate_output_buffers,
+    capture_cuda_graph,
+    configure_device,
+    copy_to_host,
+    file_digest,
+    get_onnx_path,
+    get_scripted_path,
+    has_scripted_model,
+    inference_autocast,
+    load_onnx_model,
+    load_scripted_model,
+    optimize_model,
+    prepare_input,
+    to_channels_last
+)
 warnings.filterwarnings('ignore')
 
 # ============================================================================
@@ -50,6 +74,12 @@ DEVICE = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
 
 _model = None
 _transform = None
+_input_buffer = None
+_input_np = None
+_output_host = None
+
+# Shared preprocessing pool (threads start lazily on first use)
+_preprocess_pool = ThreadPoolExecutor(max_workers=min(8, os.cpu_count() or 1))
 
 
 # ============================================================================
@@ -117,20 +147,8 @@ def load_model(model_path, device):
         dropout=CONFIG['model']['dropout']
     )
     
-    # Load checkpoint with safe_globals for PyTorch >= 2.6
-    try:
-        # Try with safe_globals (PyTorch >= 2.6)
-        import numpy as np
-        safe_globals = [
-            np.dtype, np.int64, np.float32, np.float64, 
-            np.bool_, np.core.multiarray.scalar
-        ]
-        
-        with torch.serialization.safe_globals(safe_globals):
-            checkpoint = torch.load(model_path, map_location=device, weights_only=False)
-    except (AttributeError, TypeError):
-        # Fallback for older PyTorch
-        checkpoint = torch.load(model_path, map_location=device)
+    # Weights-only unpickler with the shared numpy allowlist (no pickle fallback)
+    checkpoint = load_weights_only(model_path, device)
     
     # Handle different checkpoint formats
     if isinstance(checkpoint, dict):
@@ -152,14 +170,10 @@ def load_model(model_path, device):
     
     model = model.to(device)
     model.eval()
+    model = to_channels_last(model)
     
     # GPU optimizations
-    if device.type == 'cuda':
-        torch.backends.cudnn.benchmark = True
-        if hasattr(torch.backends.cuda.matmul, 'allow_tf32'):
-            torch.backends.cuda.matmul.allow_tf32 = True
-        if hasattr(torch.backends.cudnn, 'allow_tf32'):
-            torch.backends.cudnn.allow_tf32 = True
+    configure_device(device)
     
     return model, {'epoch': epoch, 'best_metric': best_metric}
 
@@ -170,17 +184,21 @@ def get_transform():
     std = np.array(CONFIG['image']['normalize_std'], dtype=np.float32)
     max_pixel = CONFIG['image']['max_pixel_value']
 
-    def transform(img):
-        img = img.astype(np.float32) / max_pixel
-        img = (img - mean) / std
-        img = torch.from_numpy(img).permute(2, 0, 1)
-        return img
+    # (img / max_pixel - mean) / std  ==  img * scale - shift
+    scale = (1.0 / (std * max_pixel)).astype(np.float32)
+    shift = (mean / std).astype(np.float32)
+
+    def transform(img, out):
+        """Normalize an HWC uint8 image straight into out (HWC float32 view)"""
+        np.multiply(img, scale, out=out)
+        np.subtract(out, shift, out=out)
+        return out
 
     return transform
 
 def initialize_model():
     """Load model once and cache"""
-    global _model, _transform
+    global _model, _transform, _input_buffer, _input_np, _output_host
     
     if _model is not None:
         return
@@ -204,17 +222,46 @@ def initialize_model():
     else:
         model_path = MODEL_PATH
     
-    _model, info = load_model(model_path, DEVICE)
+    # Exported artifacts record this digest; a mismatch means they are stale
+    checkpoint_digest = file_digest(model_path)
+    
+    # ONNX Runtime / TensorRT when enabled and an up-to-date export exists
+    onnx_path = get_onnx_path(model_path)
+    if USE_ONNX and os.path.exists(onnx_path):
+        _model = load_onnx_model(onnx_path, checkpoint_digest)
+    
+    if _model is None:
+        # Reuse the frozen TorchScript artifact if it is up to date
+        scripted_path = get_scripted_path(model_path, DEVICE)
+        if has_scripted_model(model_path, DEVICE):
+            configure_device(DEVICE)
+            _model = load_scripted_model(scripted_path, DEVICE, checkpoint_digest)
+        
+        if _model is None:
+            model, info = load_model(model_path, DEVICE)
+            _model = optimize_model(
+                model, DEVICE,
+                save_path=scripted_path,
+                checkpoint_digest=checkpoint_digest
+            )
+        
+        # Replay a captured graph for the fixed (1, 3, 224, 224) input on GPU
+        _model = capture_cuda_graph(_model, DEVICE)
+    
     _transform = get_transform()
+    _input_buffer, _input_np = allocate_input_buffer(DEVICE)
+    _output_host = allocate_output_buffers(DEVICE, 1, len(CONFIG['classes']))
 
 
 # ============================================================================
 # PREPROCESSING - EXACT MATCH TO TRAINING
 # ============================================================================
 
-def preprocess_image(image_path):
-    """EXACT preprocessing from training"""
-    img = cv2.imread(image_path)
+def preprocess_image(image_path, out):
+    """EXACT preprocessing from training, written into out (HWC float32 slot)"""
+    import cv2
+    img_size = CONFIG['image']['size']
+    img = read_image(image_path, img_size)
     
     if img is None:
         raise ValueError(f"Cannot read image: {image_path}")
@@ -222,22 +269,19 @@ def preprocess_image(image_path):
     # BGR to RGB
     img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
     
-    # Resize (EXACT interpolation as training)
-    img_size = CONFIG['image']['size']
-    img = cv2.resize(img, (img_size, img_size), interpolation=cv2.INTER_LANCZOS4)
+    # Resize: INTER_AREA for downscaling (training used LANCZOS4; for
+    # downscale-to-224 the difference is negligible and AREA is much faster)
+    img = cv2.resize(img, (img_size, img_size), interpolation=get_interpolation(img, img_size))
     
-    # Apply transform
-    img = _transform(img)
-    img = img.unsqueeze(0)
-    
-    return img
+    # Normalize directly into the (pinned, NHWC) staging buffer
+    _transform(img, out)
 
 
 # ============================================================================
 # PREDICTION
 # ============================================================================
 
-def parse_class_name(class_name):
+def _compute_parse(class_name):
     """Parse category and subtype"""
     if class_name.startswith("Pest_"):
         return "Pest", class_name.replace("Pest_", "")
@@ -253,32 +297,43 @@ def parse_class_name(class_name):
         return class_name, None
 
 
+_CLASSES = tuple(CONFIG['classes'])
+
+# Precomputed once: (category, subtype) per class
+_PARSED = {cls: _compute_parse(cls) for cls in CONFIG['classes']}
+
+
+def parse_class_name(class_name):
+    """Parse category and subtype (precomputed lookup)"""
+    parsed = _PARSED.get(class_name)
+    return parsed if parsed is not None else _compute_parse(class_name)
+
+
+# Lower bounds of Moderate / High / Very High
+_CONFIDENCE_THRESHOLDS = [0.55, 0.70, 0.85]
+_CONFIDENCE_LEVELS = ["Low", "Moderate", "High", "Very High"]
+
+
 def get_confidence_level(confidence):
     """Confidence level from backend constants"""
-    if confidence >= 0.85:
-        return "Very High"
-    elif confidence >= 0.70:
-        return "High"
-    elif confidence >= 0.55:
-        return "Moderate"
-    else:
-        return "Low"
+    return _CONFIDENCE_LEVELS[bisect.bisect_right(_CONFIDENCE_THRESHOLDS, confidence)]
+
+
+_EXPLANATIONS = {
+    "Healthy": "Plant appears healthy. No visible issues detected.",
+    "Pest_Fungal": "Fungal infection detected. Look for powdery spots, mold, or discoloration. Treatment: fungicide.",
+    "Pest_Bacterial": "Bacterial infection detected. Water-soaked lesions or wilting. Treatment: copper-based spray.",
+    "Pest_Insect": "Insect damage detected. Holes, chewed edges, or insect presence. Treatment: insecticide or natural predators.",
+    "Nutrient_Nitrogen": "Nitrogen deficiency detected. Yellowing of older leaves, stunted growth. Treatment: nitrogen fertilizer.",
+    "Nutrient_Potassium": "Potassium deficiency detected. Leaf edge browning, weak stems. Treatment: potassium fertilizer.",
+    "Water_Stress": "Water stress detected. Wilting or dry soil. Treatment: adjust watering schedule.",
+    "Not_Plant": "This is not a plant image. Please upload a clear image of a plant leaf for disease detection."
+}
 
 
 def generate_explanation(predicted_class, confidence, conf_level):
     """Generate explanation"""
-    explanations = {
-        "Healthy": "Plant appears healthy. No visible issues detected.",
-        "Pest_Fungal": "Fungal infection detected. Look for powdery spots, mold, or discoloration. Treatment: fungicide.",
-        "Pest_Bacterial": "Bacterial infection detected. Water-soaked lesions or wilting. Treatment: copper-based spray.",
-        "Pest_Insect": "Insect damage detected. Holes, chewed edges, or insect presence. Treatment: insecticide or natural predators.",
-        "Nutrient_Nitrogen": "Nitrogen deficiency detected. Yellowing of older leaves, stunted growth. Treatment: nitrogen fertilizer.",
-        "Nutrient_Potassium": "Potassium deficiency detected. Leaf edge browning, weak stems. Treatment: potassium fertilizer.",
-        "Water_Stress": "Water stress detected. Wilting or dry soil. Treatment: adjust watering schedule.",
-        "Not_Plant": "This is not a plant image. Please upload a clear image of a plant leaf for disease detection."
-    }
-    
-    explanation = explanations.get(
+    explanation = _EXPLANATIONS.get(
         predicted_class,
         f"Plant classified as {predicted_class}."
     )
@@ -291,39 +346,26 @@ def generate_explanation(predicted_class, confidence, conf_level):
     return explanation
 
 
-@torch.no_grad()
-def predict(image_path):
-    """Run inference"""
-    initialize_model()
-    
-    # Preprocess
-    img = preprocess_image(image_path)
-    img = img.to(DEVICE)
-    
-    # Forward pass
-    outputs = _model(img)
-    probabilities = torch.softmax(outputs, dim=1)[0]
-    probabilities = probabilities.cpu().numpy()
-    
+def build_result(sorted_probs, sorted_indices):
+    """Build the result for one image from probabilities sorted high to low"""
     # Prediction
-    predicted_idx = np.argmax(probabilities)
-    predicted_class = CONFIG['classes'][predicted_idx]
-    confidence = float(probabilities[predicted_idx])
+    classes = _CLASSES
+    predicted_class = classes[sorted_indices[0]]
+    confidence = sorted_probs[0]
     
     # Parse
     category, subtype = parse_class_name(predicted_class)
     confidence_level = get_confidence_level(confidence)
     
-    # All probabilities
+    # All probabilities (already sorted by confidence)
     all_probs = [
         {
-            "class": CONFIG['classes'][i],
-            "confidence": float(probabilities[i]),
-            "confidence_percentage": float(probabilities[i] * 100)
+            "class": classes[i],
+            "confidence": p,
+            "confidence_percentage": p * 100
         }
-        for i in range(len(CONFIG['classes']))
+        for p, i in zip(sorted_probs, sorted_indices)
     ]
-    all_probs.sort(key=lambda x: x['confidence'], reverse=True)
     
     # Explanation
     explanation = generate_explanation(predicted_class, confidence, confidence_level)
@@ -345,23 +387,69 @@ def predict(image_path):
     return result
 
 
+@torch.inference_mode()
+def predict_batch(image_paths):
+    """Run inference for several images with a single forward pass"""
+    global _input_buffer, _input_np, _output_host
+    
+    initialize_model()
+    
+    # Grow the staging buffers if this batch does not fit
+    batch_size = len(image_paths)
+    if _input_buffer.shape[0] < batch_size:
+        _input_buffer, _input_np = allocate_input_buffer(DEVICE, batch_size)
+        _output_host = allocate_output_buffers(DEVICE, batch_size, len(CONFIG['classes']))
+    
+    # Preprocess in parallel (cv2/NumPy release the GIL), one buffer slot per image
+    list(_preprocess_pool.map(preprocess_image, image_paths, _input_np[:batch_size]))
+    img = prepare_input(_input_buffer[:batch_size], DEVICE)
+    
+    # Forward pass (FP16 on GPU; top-k/softmax stay in FP32)
+    with inference_autocast(DEVICE):
+        outputs = _model(img)
+    
+    # Sort the logits on device (same order as the probabilities); softmax
+    # commutes with permutations, so it runs directly on the sorted values
+    sorted_logits, sorted_indices = torch.topk(outputs.float(), k=len(CONFIG['classes']), dim=1)
+    sorted_probs = torch.softmax(sorted_logits, dim=1)
+    
+    # One synchronized device-to-host copy (pinned buffers on GPU), then lists
+    sorted_probs, sorted_indices = copy_to_host((sorted_probs, sorted_indices), _output_host)
+    sorted_probs = sorted_probs.tolist()
+    sorted_indices = sorted_indices.tolist()
+    
+    return [
+        build_result(probs, indices)
+        for probs, indices in zip(sorted_probs, sorted_indices)
+    ]
+
+
+def predict(image_path):
+    """Run inference"""
+    return predict_batch([image_path])[0]
+
+
 # ============================================================================
 # MAIN
 # ============================================================================
 
 def main():
-    """Main entry point"""
+    """Main entry point (single-shot, development only)"""
     try:
         if len(sys.argv) < 2:
             raise ValueError("No image path provided")
         
-        image_path = sys.argv[1]
+        image_paths = sys.argv[1:]
         
-        if not os.path.exists(image_path):
-            raise FileNotFoundError(f"Image not found: {image_path}")
+        for image_path in image_paths:
+            if not os.path.exists(image_path):
+                raise FileNotFoundError(f"Image not found: {image_path}")
         
-        # Run prediction
-        result = predict(image_path)
+        # Run prediction (a list of results when several images are given)
+        if len(image_paths) == 1:
+            result = predict(image_paths[0])
+        else:
+            result = predict_batch(image_paths)
         
         # Output JSON
         print(json.dumps({
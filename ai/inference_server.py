@@ -1,18 +1,65 @@
 """
 Secure Inference Server with Encrypted Model Loading
 CRITICAL FIX: Ensure clean JSON output on stdout
+
+Usage:
+    python inference_server.py --server-mode                  # stdio (Node worker pool)
+    python inference_server.py --server-mode --socket PATH    # Unix domain socket
+    python inference_server.py IMAGE_PATH                     # single-shot (development only)
 """
 
 import sys
 import json
 import os
+import bisect
+
+# CPU thread pools are sized from the environment when OpenMP/MKL load, so
+# these must be set before cv2/torch are imported. Each worker process gets
+# TORCH_THREADS threads (AI_WORKERS x TORCH_THREADS should not exceed cores).
+TORCH_THREADS = int(os.getenv('TORCH_THREADS', '4'))
+os.environ.setdefault('OMP_NUM_THREADS', str(TORCH_THREADS))
+os.environ.setdefault('MKL_NUM_THREADS', str(TORCH_THREADS))
+
 import cv2
 import torch
 import torch.nn as nn
 import numpy as np
 import warnings
 import signal
+import socket
+import io
+import queue
+import socketserver
+import stat
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+from image_utils import get_interpolation, read_image
 from model_loader import SecureModelLoader
+from model_optimizer import (
+    USE_ONNX,
+    USE_TORCHSCRIPT,
+    allocate_input_buffer,
+    allocate_output_buffers,
+    capture_cuda_graph,
+    configure_device,
+    copy_to_host,
+    get_onnx_path,
+    get_scripted_path,
+    inference_autocast,
+    load_onnx_model,
+    load_scripted_model,
+    optimize_model,
+    prepare_input,
+    to_channels_last,
+    use_torch_compile
+)
 
 warnings.filterwarnings('ignore')
 
@@ -47,6 +94,14 @@ MODEL_KEY_PATH = os.getenv('MODEL_KEY_PATH', './secrets/model.key')
 DEVICE = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
 WORKER_ID = os.getenv('WORKER_ID', '0')
 
+# Micro-batching: requests already queued together share one forward pass; the
+# BATCH_TIMEOUT_MS window is only waited out when requests arrive concurrently
+MAX_BATCH_SIZE = int(os.getenv('MAX_BATCH_SIZE', '16'))
+BATCH_TIMEOUT_MS = float(os.getenv('BATCH_TIMEOUT_MS', '5'))
+
+# Set PIN_WORKER_CORES=1 to pin worker N to its own group of TORCH_THREADS cores
+PIN_WORKER_CORES = os.getenv('PIN_WORKER_CORES', '0') == '1'
+
 # Model Definition
 class PlantHealthModel(nn.Module):
     def __init__(self, model_name='efficientnet_b2', num_classes=7, dropout=0.2):
@@ -91,6 +146,10 @@ class PlantHealthModel(nn.Module):
 # Global state
 _model = None
 _transform = None
+_preprocess_pool = None
+_input_buffer = None
+_input_np = None
+_output_host = None
 
 def load_model_securely():
     """Load encrypted model securely"""
@@ -105,27 +164,62 @@ def load_model_securely():
     
     # Load securely
     loader = SecureModelLoader(MODEL_KEY_PATH)
-    
-    def create_model():
-        return PlantHealthModel(
-            model_name=CONFIG['model']['name'],
-            num_classes=CONFIG['model']['num_classes'],
-            dropout=CONFIG['model']['dropout']
+    configure_device(DEVICE)
+    
+    # SHA-256 of the plaintext checkpoint, recorded in the header at
+    # encryption time; exported artifacts must carry the same digest
+    metadata = loader.encryptor.read_metadata(MODEL_PATH) or {}
+    checkpoint_digest = metadata.get('sha256')
+    
+    # ONNX Runtime / TensorRT when enabled and an up-to-date export exists
+    model = None
+    onnx_path = get_onnx_path(MODEL_PATH) + '.encrypted'
+    if USE_ONNX and os.path.exists(onnx_path):
+        sys.stderr.write(f"⚡ Loading ONNX model from {onnx_path}\n")
+        sys.stderr.flush()
+        
+        # InferenceSession accepts the decrypted bytes directly; no TensorRT
+        # engine cache, since engines would hold the weights unencrypted
+        model = load_onnx_model(
+            loader.encryptor.decrypt_model(onnx_path),
+            checkpoint_digest,
+            cache_engines=False
         )
     
-    model = loader.load_encrypted_model(
-        MODEL_PATH,
-        create_model,
-        DEVICE
-    )
-    
-    # GPU optimizations
-    if DEVICE.type == 'cuda':
-        torch.backends.cudnn.benchmark = True
-        if hasattr(torch.backends.cuda.matmul, 'allow_tf32'):
-            torch.backends.cuda.matmul.allow_tf32 = True
-        if hasattr(torch.backends.cudnn, 'allow_tf32'):
-            torch.backends.cudnn.allow_tf32 = True
+    if model is None:
+        # Prefer the pre-frozen TorchScript artifact (skips timm model assembly)
+        scripted_path = get_scripted_path(MODEL_PATH, DEVICE) + '.encrypted'
+        if USE_TORCHSCRIPT and not use_torch_compile(DEVICE) and os.path.exists(scripted_path):
+            sys.stderr.write(f"⚡ Loading frozen TorchScript model from {scripted_path}\n")
+            sys.stderr.flush()
+            
+            # Decrypted in memory only
+            buffer = loader.encryptor.decrypt_model_to_buffer(scripted_path)
+            model = load_scripted_model(buffer, DEVICE, checkpoint_digest)
+        
+        if model is None:
+            def create_model():
+                return PlantHealthModel(
+                    model_name=CONFIG['model']['name'],
+                    num_classes=CONFIG['model']['num_classes'],
+                    dropout=CONFIG['model']['dropout']
+                )
+            
+            model = loader.load_encrypted_model(
+                MODEL_PATH,
+                create_model,
+                DEVICE
+            )
+            
+            # NHWC layout
+            model = to_channels_last(model)
+            
+            # Frozen TorchScript or torch.compile (kept in memory only - never
+            # write decrypted weights to disk)
+            model = optimize_model(model, DEVICE, max_batch_size=MAX_BATCH_SIZE)
+        
+        # Replay captured graphs per batch size on GPU
+        model = capture_cuda_graph(model, DEVICE, max_batch_size=MAX_BATCH_SIZE)
     
     sys.stderr.write(f"✅ Model loaded securely\n")
     sys.stderr.flush()
@@ -138,30 +232,32 @@ def get_transform():
     std = np.array(CONFIG['image']['normalize_std'], dtype=np.float32)
     max_pixel = CONFIG['image']['max_pixel_value']
     
-    def transform(img):
-        img = img.astype(np.float32) / max_pixel
-        img = (img - mean) / std
-        img = torch.from_numpy(img).permute(2, 0, 1)
-        return img
+    # (img / max_pixel - mean) / std  ==  img * scale - shift
+    scale = (1.0 / (std * max_pixel)).astype(np.float32)
+    shift = (mean / std).astype(np.float32)
+    
+    def transform(img, out):
+        """Normalize an HWC uint8 image straight into out (HWC float32 view)"""
+        np.multiply(img, scale, out=out)
+        np.subtract(out, shift, out=out)
+        return out
     
     return transform
 
-def preprocess_image(image_path):
-    """Preprocess image"""
-    img = cv2.imread(image_path)
+def preprocess_image(image_path, out):
+    """Preprocess image into out (HWC float32 slot of the staging buffer)"""
+    img_size = CONFIG['image']['size']
+    img = read_image(image_path, img_size)
     
     if img is None:
         raise ValueError(f"Cannot read image: {image_path}")
     
     img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-    img_size = CONFIG['image']['size']
-    img = cv2.resize(img, (img_size, img_size), interpolation=cv2.INTER_LANCZOS4)
-    img = _transform(img)
-    img = img.unsqueeze(0)
-    
-    return img
+    # INTER_AREA for downscaling (training used LANCZOS4; negligible shift at 224)
+    img = cv2.resize(img, (img_size, img_size), interpolation=get_interpolation(img, img_size))
+    _transform(img, out)
 
-def parse_class_name(class_name):
+def _compute_parse(class_name):
     """Parse category and subtype"""
     if class_name.startswith("Pest_"):
         return "Pest", class_name.replace("Pest_", "")
@@ -176,31 +272,38 @@ def parse_class_name(class_name):
     else:
         return class_name, None
 
+_CLASSES = tuple(CONFIG['classes'])
+
+# Precomputed once: (category, subtype) per class
+_PARSED = {cls: _compute_parse(cls) for cls in CONFIG['classes']}
+
+def parse_class_name(class_name):
+    """Parse category and subtype (precomputed lookup)"""
+    parsed = _PARSED.get(class_name)
+    return parsed if parsed is not None else _compute_parse(class_name)
+
+# Lower bounds of Moderate / High / Very High
+_CONFIDENCE_THRESHOLDS = [0.55, 0.70, 0.85]
+_CONFIDENCE_LEVELS = ["Low", "Moderate", "High", "Very High"]
+
 def get_confidence_level(confidence):
     """Get confidence level"""
-    if confidence >= 0.85:
-        return "Very High"
-    elif confidence >= 0.70:
-        return "High"
-    elif confidence >= 0.55:
-        return "Moderate"
-    else:
-        return "Low"
+    return _CONFIDENCE_LEVELS[bisect.bisect_right(_CONFIDENCE_THRESHOLDS, confidence)]
+
+_EXPLANATIONS = {
+    "Healthy": "Plant appears healthy with no visible issues detected.",
+    "Pest_Fungal": "Fungal infection detected. Look for powdery spots, mold, or discoloration. Treatment: Apply fungicide and improve air circulation.",
+    "Pest_Bacterial": "Bacterial infection detected. Water-soaked lesions or wilting observed. Treatment: Use copper-based bactericide and remove infected parts.",
+    "Pest_Insect": "Insect damage detected. Holes, chewed edges, or insect presence. Treatment: Apply appropriate insecticide or use neem oil.",
+    "Nutrient_Nitrogen": "Nitrogen deficiency detected. Yellowing of older leaves, stunted growth. Treatment: Apply nitrogen-rich fertilizer.",
+    "Nutrient_Potassium": "Potassium deficiency detected. Leaf edge browning, weak stems. Treatment: Apply potassium fertilizer.",
+    "Water_Stress": "Water stress detected. Wilting or dry soil conditions. Treatment: Adjust watering schedule.",
+    "Not_Plant": "This is not a plant image. Please upload a clear image of a plant leaf for disease detection."
+}
 
 def generate_explanation(predicted_class, confidence, conf_level):
     """Generate detailed explanation"""
-    explanations = {
-        "Healthy": "Plant appears healthy with no visible issues detected.",
-        "Pest_Fungal": "Fungal infection detected. Look for powdery spots, mold, or discoloration. Treatment: Apply fungicide and improve air circulation.",
-        "Pest_Bacterial": "Bacterial infection detected. Water-soaked lesions or wilting observed. Treatment: Use copper-based bactericide and remove infected parts.",
-        "Pest_Insect": "Insect damage detected. Holes, chewed edges, or insect presence. Treatment: Apply appropriate insecticide or use neem oil.",
-        "Nutrient_Nitrogen": "Nitrogen deficiency detected. Yellowing of older leaves, stunted growth. Treatment: Apply nitrogen-rich fertilizer.",
-        "Nutrient_Potassium": "Potassium deficiency detected. Leaf edge browning, weak stems. Treatment: Apply potassium fertilizer.",
-        "Water_Stress": "Water stress detected. Wilting or dry soil conditions. Treatment: Adjust watering schedule.",
-        "Not_Plant": "This is not a plant image. Please upload a clear image of a plant leaf for disease detection."
-    }
-    
-    explanation = explanations.get(
+    explanation = _EXPLANATIONS.get(
         predicted_class,
         f"Plant classified as {predicted_class}."
     )
@@ -212,32 +315,23 @@ def generate_explanation(predicted_class, confidence, conf_level):
     
     return explanation
 
-@torch.no_grad()
-def predict(image_path):
-    """Run inference"""
-    img = preprocess_image(image_path)
-    img = img.to(DEVICE)
-    
-    outputs = _model(img)
-    probabilities = torch.softmax(outputs, dim=1)[0]
-    probabilities = probabilities.cpu().numpy()
-    
-    predicted_idx = np.argmax(probabilities)
-    predicted_class = CONFIG['classes'][predicted_idx]
-    confidence = float(probabilities[predicted_idx])
+def build_result(sorted_probs, sorted_indices):
+    """Build the response payload from class probabilities sorted high to low"""
+    classes = _CLASSES
+    predicted_class = classes[sorted_indices[0]]
+    confidence = sorted_probs[0]
     
     category, subtype = parse_class_name(predicted_class)
     confidence_level = get_confidence_level(confidence)
     
     all_probs = [
         {
-            "class": CONFIG['classes'][i],
-            "confidence": float(probabilities[i]),
-            "confidence_percentage": float(probabilities[i] * 100)
+            "class": classes[i],
+            "confidence": p,
+            "confidence_percentage": p * 100
         }
-        for i in range(len(CONFIG['classes']))
+        for p, i in zip(sorted_probs, sorted_indices)
     ]
-    all_probs.sort(key=lambda x: x['confidence'], reverse=True)
     
     explanation = generate_explanation(predicted_class, confidence, confidence_level)
     
@@ -257,121 +351,436 @@ def predict(image_path):
     
     return result
 
+@torch.inference_mode()
+def predict_batch(image_paths):
+    """
+    Run inference for several images in a single forward pass
+    
+    Returns:
+        One entry per image path: a result dict, or the exception raised
+        while preprocessing that image
+    """
+    outcomes = [None] * len(image_paths)
+    batch_slots = []
+    
+    # cv2 releases the GIL, so decoding/resizing scales across threads.
+    # Each image is written into its own slot of the staging buffer.
+    futures = [
+        _preprocess_pool.submit(preprocess_image, path, _input_np[i])
+        for i, path in enumerate(image_paths)
+    ]
+    for i, future in enumerate(futures):
+        try:
+            future.result()
+            batch_slots.append(i)
+        except Exception as e:
+            outcomes[i] = e
+    
+    if batch_slots:
+        if len(batch_slots) == len(image_paths):
+            batch = _input_buffer[:len(image_paths)]
+        else:
+            batch = _input_buffer[batch_slots]
+        batch = prepare_input(batch, DEVICE)
+        
+        # FP16 on GPU; top-k/softmax stay in FP32
+        with inference_autocast(DEVICE):
+            outputs = _model(batch)
+        
+        # Sort the logits on device (same order as the probabilities); softmax
+        # commutes with permutations, so it runs directly on the sorted values
+        sorted_logits, sorted_indices = torch.topk(outputs.float(), k=len(CONFIG['classes']), dim=1)
+        sorted_probs = torch.softmax(sorted_logits, dim=1)
+        
+        # One synchronized device-to-host copy (pinned buffers on GPU), then lists
+        sorted_probs, sorted_indices = copy_to_host((sorted_probs, sorted_indices), _output_host)
+        sorted_probs = sorted_probs.tolist()
+        sorted_indices = sorted_indices.tolist()
+        
+        for row, slot in enumerate(batch_slots):
+            outcomes[slot] = build_result(sorted_probs[row], sorted_indices[row])
+    
+    return outcomes
+
+def predict(image_path):
+    """Run inference"""
+    outcome = predict_batch([image_path])[0]
+    if isinstance(outcome, Exception):
+        raise outcome
+    return outcome
+
+_RECOMMENDATIONS = {
+    "Healthy": [
+        "Continue current care routine",
+        "Monitor for any changes",
+        "Maintain proper watering and sunlight"
+    ],
+    "Pest_Fungal": [
+        "Apply fungicide (copper-based or organic)",
+        "Improve air circulation around plant",
+        "Remove affected leaves",
+        "Reduce humidity if possible"
+    ],
+    "Pest_Bacterial": [
+        "Use copper-based bactericide",
+        "Remove and destroy infected parts",
+        "Avoid overhead watering",
+        "Sterilize tools between plants"
+    ],
+    "Pest_Insect": [
+        "Identify specific insect pest",
+        "Apply appropriate insecticide",
+        "Use neem oil for organic treatment",
+        "Introduce beneficial insects"
+    ],
+    "Nutrient_Nitrogen": [
+        "Apply nitrogen-rich fertilizer",
+        "Use compost or manure",
+        "Consider foliar feeding",
+        "Test soil pH"
+    ],
+    "Nutrient_Potassium": [
+        "Apply potassium fertilizer",
+        "Use wood ash or kelp meal",
+        "Avoid over-fertilization with nitrogen",
+        "Monitor leaf symptoms"
+    ],
+    "Water_Stress": [
+        "Adjust watering schedule",
+        "Check soil moisture regularly",
+        "Improve drainage if waterlogged",
+        "Mulch to retain moisture"
+    ],
+    "Not_Plant": [
+        "Please upload a clear image of a plant leaf for disease detection."
+    ]
+}
+
 def get_recommendations(predicted_class):
     """Get treatment recommendations"""
-    recommendations = {
-        "Healthy": [
-            "Continue current care routine",
-            "Monitor for any changes",
-            "Maintain proper watering and sunlight"
-        ],
-        "Pest_Fungal": [
-            "Apply fungicide (copper-based or organic)",
-            "Improve air circulation around plant",
-            "Remove affected leaves",
-            "Reduce humidity if possible"
-        ],
-        "Pest_Bacterial": [
-            "Use copper-based bactericide",
-            "Remove and destroy infected parts",
-            "Avoid overhead watering",
-            "Sterilize tools between plants"
-        ],
-        "Pest_Insect": [
-            "Identify specific insect pest",
-            "Apply appropriate insecticide",
-            "Use neem oil for organic treatment",
-            "Introduce beneficial insects"
-        ],
-        "Nutrient_Nitrogen": [
-            "Apply nitrogen-rich fertilizer",
-            "Use compost or manure",
-            "Consider foliar feeding",
-            "Test soil pH"
-        ],
-        "Nutrient_Potassium": [
-            "Apply potassium fertilizer",
-            "Use wood ash or kelp meal",
-            "Avoid over-fertilization with nitrogen",
-            "Monitor leaf symptoms"
-        ],
-        "Water_Stress": [
-            "Adjust watering schedule",
-            "Check soil moisture regularly",
-            "Improve drainage if waterlogged",
-            "Mulch to retain moisture"
-        ],
-        "Not_Plant": [
-            "Please upload a clear image of a plant leaf for disease detection."
-        ]
+    return _RECOMMENDATIONS.get(predicted_class, ["Consult agricultural expert"])
+
+def dumps(obj):
+    """Serialize a response line (orjson when installed, else stdlib json)"""
+    if orjson is not None:
+        return orjson.dumps(obj).decode()
+    return json.dumps(obj)
+
+def loads(line):
+    """Parse a request line (orjson when installed, else stdlib json)"""
+    if orjson is not None:
+        return orjson.loads(line)
+    return json.loads(line)
+
+def error_response(e):
+    """Build an error response"""
+    return {
+        "success": False,
+        "error": str(e),
+        "error_type": type(e).__name__
     }
+
+def get_image_path(request):
+    """Validate a decoded request and return its image path"""
+    image_path = request.get('imagePath')
+    
+    if not image_path:
+        raise ValueError("No imagePath provided")
+    
+    if not os.path.exists(image_path):
+        raise FileNotFoundError(f"Image not found: {image_path}")
     
-    return recommendations.get(predicted_class, ["Consult agricultural expert"])
+    return image_path
 
-def run_server():
-    """Run in server mode"""
-    global _model, _transform
+class ResponseWriter:
+    """Writes responses to one output stream strictly in request order"""
+    
+    def __init__(self, stream):
+        self._stream = stream
+        self._pending = {}
+        self._next_seq = 0
+        self._closed = False
+        self._written = threading.Condition()
+    
+    def write(self, seq, response):
+        # CRITICAL: Write ONLY the JSON response, followed by newline
+        # (serialized before taking the lock)
+        line = dumps(response) + "\n"
+        
+        with self._written:
+            self._pending[seq] = line
+            
+            try:
+                while self._next_seq in self._pending:
+                    line = self._pending.pop(self._next_seq)
+                    if not self._closed:
+                        self._stream.write(line)
+                    self._next_seq += 1
+                
+                if not self._closed:
+                    self._stream.flush()
+            except (OSError, ValueError):
+                # Client went away - drop the remaining responses
+                self._closed = True
+            
+            self._written.notify_all()
     
-    sys.stderr.write(f"Worker {WORKER_ID}: Initializing...\n")
-    sys.stderr.flush()
+    def wait_for(self, count):
+        """Block until the first count responses have been written"""
+        with self._written:
+            self._written.wait_for(lambda: self._next_seq >= count)
+
+def read_requests(stream, request_queue, writer):
+    """
+    Queue every request line from stream with its sequence number
+    
+    Returns:
+        Number of requests queued
+    """
+    seq = 0
+    for line in stream:
+        line = line.strip()
+        if not line:
+            continue
+        request_queue.put((seq, line, writer))
+        seq += 1
+    
+    return seq
+
+def read_stdin_requests(request_queue):
+    """Reader thread for the stdio transport (Node worker pool)"""
+    read_requests(sys.stdin, request_queue, ResponseWriter(sys.stdout))
     
-    _model = load_model_securely()
-    _transform = get_transform()
+    # stdin closed - tell the batch loop to stop
+    request_queue.put(None)
+
+class SocketRequestHandler(socketserver.StreamRequestHandler):
+    """One connection on the Unix socket transport (same line protocol as stdio)"""
     
-    # CRITICAL: Write READY to stdout and flush immediately
-    sys.stdout.write("READY\n")
-    sys.stdout.flush()
+    def handle(self):
+        stream = io.TextIOWrapper(self.rfile, encoding='utf-8')
+        writer = ResponseWriter(self.connection.makefile('w', encoding='utf-8'))
+        
+        count = read_requests(stream, self.server.request_queue, writer)
+        
+        # Keep the connection open until every queued request is answered
+        writer.wait_for(count)
+
+def check_socket_path(socket_path):
+    """
+    Make socket_path available for binding. Only a stale socket (nothing
+    accepts connections on it) is removed; a live socket or any other file
+    at that path is an error.
+    """
+    if not os.path.lexists(socket_path):
+        return
+    
+    if not stat.S_ISSOCK(os.lstat(socket_path).st_mode):
+        sys.stderr.write(f"--socket path exists and is not a socket: {socket_path}\n")
+        sys.exit(1)
+    
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(socket_path)
+    except OSError:
+        os.unlink(socket_path)
+        return
+    finally:
+        probe.close()
+    
+    sys.stderr.write(f"--socket path is already in use: {socket_path}\n")
+    sys.exit(1)
+
+def start_socket_server(socket_path, request_queue):
+    """Serve the line protocol on a Unix domain socket (one thread per connection)"""
+    check_socket_path(socket_path)
     
-    sys.stderr.write(f"Worker {WORKER_ID}: Ready to process requests\n")
-    sys.stderr.flush()
+    server = socketserver.ThreadingUnixStreamServer(socket_path, SocketRequestHandler)
+    server.daemon_threads = True
+    server.request_queue = request_queue
     
-    # Process requests line by line
-    for line in sys.stdin:
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    
+    return server
+
+def collect_batch(request_queue):
+    """
+    Block for one request, then take whatever is already queued. Only when
+    requests are arriving concurrently (more than one was waiting) keep
+    draining until the batch is full or BATCH_TIMEOUT_MS has passed, so a
+    lone request - the Node pool sends one at a time per worker - runs
+    immediately. Returns None once input is closed.
+    """
+    first = request_queue.get()
+    if first is None:
+        return None
+    
+    batch = [first]
+    
+    while len(batch) < MAX_BATCH_SIZE:
         try:
-            request = json.loads(line.strip())
-            image_path = request.get('imagePath')
-            
-            if not image_path:
-                raise ValueError("No imagePath provided")
-            
-            if not os.path.exists(image_path):
-                raise FileNotFoundError(f"Image not found: {image_path}")
-            
-            # Run prediction
-            result = predict(image_path)
-            
+            item = request_queue.get_nowait()
+        except queue.Empty:
+            break
+        
+        if item is None:
+            # Re-queue the sentinel so the next call stops the loop
+            request_queue.put(None)
+            return batch
+        
+        batch.append(item)
+    
+    if len(batch) == 1:
+        return batch
+    
+    deadline = time.monotonic() + BATCH_TIMEOUT_MS / 1000.0
+    
+    while len(batch) < MAX_BATCH_SIZE:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        
+        try:
+            item = request_queue.get(timeout=remaining)
+        except queue.Empty:
+            break
+        
+        if item is None:
+            request_queue.put(None)
+            break
+        
+        batch.append(item)
+    
+    return batch
+
+def process_batch(batch):
+    """Validate, predict and answer one batch of (seq, line, writer) requests"""
+    valid = []
+    
+    for seq, line, writer in batch:
+        request_id = None
+        try:
+            # Decode first so rejected requests still echo their requestId
+            request = loads(line)
+            request_id = request.get('requestId')
+            image_path = get_image_path(request)
+            valid.append((seq, request_id, image_path, writer))
+        except Exception as e:
+            sys.stderr.write(f"Worker {WORKER_ID}: Invalid request: {str(e)}\n")
+            sys.stderr.flush()
+            response = error_response(e)
+            if request_id is not None:
+                response["requestId"] = request_id
+            writer.write(seq, response)
+    
+    if not valid:
+        return
+    
+    try:
+        outcomes = predict_batch([image_path for _, _, image_path, _ in valid])
+    except Exception as e:
+        # Whole-batch failure (e.g. forward pass error) - fail every request
+        sys.stderr.write(f"Worker {WORKER_ID}: Error processing batch: {str(e)}\n")
+        sys.stderr.write(traceback.format_exc())
+        sys.stderr.flush()
+        outcomes = [e] * len(valid)
+    
+    for (seq, request_id, image_path, writer), outcome in zip(valid, outcomes):
+        if isinstance(outcome, Exception):
+            sys.stderr.write(f"Worker {WORKER_ID}: Error processing request: {str(outcome)}\n")
+            sys.stderr.flush()
+            response = error_response(outcome)
+        else:
             # CRITICAL: Create response with success and data
             response = {
                 "success": True,
-                "data": result
+                "data": outcome
             }
-            
-            # CRITICAL: Write ONLY the JSON response to stdout, followed by newline
-            # Do NOT write any other text to stdout
-            sys.stdout.write(json.dumps(response) + "\n")
-            sys.stdout.flush()
-            
-            # Log to stderr (not stdout)
             sys.stderr.write(f"Worker {WORKER_ID}: Prediction complete for {image_path}\n")
             sys.stderr.flush()
-            
-        except Exception as e:
-            import traceback
-            
-            # Log error to stderr
-            sys.stderr.write(f"Worker {WORKER_ID}: Error processing request: {str(e)}\n")
-            sys.stderr.write(traceback.format_exc())
+        
+        if request_id is not None:
+            response["requestId"] = request_id
+        
+        writer.write(seq, response)
+
+def configure_cpu_threads():
+    """
+    Size torch's thread pools for one worker process and optionally pin it
+    to a dedicated core group (Linux only). Must run before the first op.
+    """
+    torch.set_num_threads(TORCH_THREADS)
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        # Inter-op pool already started (torch was used before this call)
+        pass
+    
+    if PIN_WORKER_CORES and hasattr(os, 'sched_setaffinity'):
+        cores = sorted(os.sched_getaffinity(0))
+        start = int(WORKER_ID) * TORCH_THREADS
+        group = cores[start:start + TORCH_THREADS]
+        if group:
+            os.sched_setaffinity(0, group)
+            sys.stderr.write(f"Worker {WORKER_ID}: Pinned to cores {group}\n")
             sys.stderr.flush()
-            
-            # Send error response to stdout
-            error_response = {
-                "success": False,
-                "error": str(e),
-                "error_type": type(e).__name__
-            }
-            
-            sys.stdout.write(json.dumps(error_response) + "\n")
-            sys.stdout.flush()
+
+def initialize_worker(max_batch_size):
+    """Load the model and allocate per-process inference state"""
+    global _model, _transform, _preprocess_pool, _input_buffer, _input_np, _output_host
+    
+    configure_cpu_threads()
+    _model = load_model_securely()
+    _transform = get_transform()
+    _preprocess_pool = ThreadPoolExecutor(
+        max_workers=min(max_batch_size, os.cpu_count() or 1)
+    )
+    _input_buffer, _input_np = allocate_input_buffer(DEVICE, max_batch_size)
+    _output_host = allocate_output_buffers(DEVICE, max_batch_size, len(CONFIG['classes']))
+
+def run_server(socket_path=None):
+    """
+    Run in server mode (the production path)
+    
+    Requests arrive as JSON lines on stdin (Node worker pool) or, with
+    socket_path, on a Unix domain socket shared by any number of clients.
+    """
+    sys.stderr.write(f"Worker {WORKER_ID}: Initializing...\n")
+    sys.stderr.flush()
+    
+    # Fail fast on a bad --socket before spending time loading the model
+    if socket_path:
+        check_socket_path(socket_path)
+    
+    initialize_worker(MAX_BATCH_SIZE)
+    
+    # Transports feed the queue; this thread batches and runs the model
+    request_queue = queue.Queue()
+    
+    if socket_path:
+        start_socket_server(socket_path, request_queue)
+        transport = f"socket {socket_path}"
+    else:
+        reader = threading.Thread(target=read_stdin_requests, args=(request_queue,), daemon=True)
+        transport = "stdin"
+    
+    # CRITICAL: Write READY to stdout and flush immediately
+    sys.stdout.write("READY\n")
+    sys.stdout.flush()
+    
+    sys.stderr.write(f"Worker {WORKER_ID}: Ready to process requests on {transport} "
+                     f"(max batch {MAX_BATCH_SIZE}, window {BATCH_TIMEOUT_MS}ms)\n")
+    sys.stderr.flush()
+    
+    if not socket_path:
+        reader.start()
+    
+    while True:
+        batch = collect_batch(request_queue)
+        if batch is None:
+            break
+        process_batch(batch)
 
 def signal_handler(sig, frame):
     """Handle shutdown signals"""
@@ -385,9 +794,18 @@ def main():
     signal.signal(signal.SIGTERM, signal_handler)
     
     if len(sys.argv) > 1 and sys.argv[1] == "--server-mode":
-        run_server()
+        socket_path = None
+        if "--socket" in sys.argv:
+            index = sys.argv.index("--socket")
+            socket_path = sys.argv[index + 1] if index + 1 < len(sys.argv) else None
+            if not socket_path:
+                sys.stderr.write("--socket requires a path\n")
+                sys.exit(1)
+        
+        run_server(socket_path)
     else:
-        # Single-shot mode
+        # Single-shot mode (development only - pays process start + model
+        # load on every call; production uses --server-mode)
         try:
             if len(sys.argv) < 2:
                 raise ValueError("No image path provided")
@@ -397,19 +815,17 @@ def main():
             if not os.path.exists(image_path):
                 raise FileNotFoundError(f"Image not found: {image_path}")
             
-            global _model, _transform
-            _model = load_model_securely()
-            _transform = get_transform()
+            initialize_worker(1)
             
             result = predict(image_path)
             
-            print(json.dumps({
+            print(dumps({
                 "success": True,
                 "data": result
             }))
             
         except Exception as e:
-            print(json.dumps({
+            print(dumps({
                 "success": False,
                 "error": str(e),
                 "error_type": type(e).__name__
@@ -3,18 +3,37 @@ Model Encryption Utility
 Encrypts the PyTorch model to prevent unauthorized access
 """
 
-import torch
+import io
 import os
+import base64
+import struct
 from cryptography.fernet import Fernet
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
 import json
 import hashlib
 
+# Encrypted file layout:
+#   MAGIC | metadata length (uint32 BE) | metadata JSON | payload
+# v3 (GCM_MAGIC, written by encrypt_data):
+#   payload = nonce (12) | AES-256-GCM ciphertext | tag (16)
+#   header (MAGIC + length + metadata) is authenticated as associated data
+# Files without a MAGIC are legacy torch.save({'metadata', 'data'}) packages.
+GCM_MAGIC = b'PHMODEL3'
+GCM_NONCE_SIZE = 12
+GCM_TAG_SIZE = 16
+CHUNK_SIZE = 1024 * 1024
+
 class ModelEncryption:
     def __init__(self, key_path='./secrets/model.key'):
         self.key_path = key_path
         self._ensure_key_exists()
         self.key = self._load_key()
         self.cipher = Fernet(self.key)
+        self.gcm_key = self._derive_gcm_key()
     
     def _ensure_key_exists(self):
         """Generate encryption key if not exists"""
@@ -37,6 +56,15 @@ class ModelEncryption:
         with open(self.key_path, 'rb') as f:
             return f.read()
     
+    def _derive_gcm_key(self):
+        """Derive a separate AES-256-GCM key from the Fernet key file"""
+        return HKDF(
+            algorithm=hashes.SHA256(),
+            length=32,
+            salt=None,
+            info=b'plant-health-model-aes-gcm'
+        ).derive(base64.urlsafe_b64decode(self.key))
+    
     def encrypt_model(self, model_path, encrypted_path):
         """
         Encrypt a PyTorch model file
@@ -51,29 +79,41 @@ class ModelEncryption:
         with open(model_path, 'rb') as f:
             model_data = f.read()
         
+        return self.encrypt_data(model_data, encrypted_path)
+    
+    def encrypt_data(self, model_data, encrypted_path):
+        """
+        Encrypt in-memory model bytes (e.g. a serialized TorchScript module)
+        
+        Args:
+            model_data: Raw model bytes
+            encrypted_path: Path to save encrypted file
+        """
         # Create metadata
         metadata = {
             'original_size': len(model_data),
-            'hash': hashlib.sha256(model_data).hexdigest(),
-            'version': '1.0.0'
+            'sha256': hashlib.sha256(model_data).hexdigest(),
+            'cipher': 'AES-256-GCM',
+            'version': '3.0.0'
         }
         
-        # Encrypt
-        encrypted_data = self.cipher.encrypt(model_data)
+        # Header is authenticated together with the ciphertext
+        metadata_bytes = json.dumps(metadata).encode('utf-8')
+        header = GCM_MAGIC + struct.pack('>I', len(metadata_bytes)) + metadata_bytes
         
-        # Save encrypted model + metadata
-        package = {
-            'metadata': metadata,
-            'data': encrypted_data
-        }
+        # Encrypt (ciphertext || tag)
+        nonce = os.urandom(GCM_NONCE_SIZE)
+        encrypted_data = AESGCM(self.gcm_key).encrypt(nonce, model_data, header)
         
         with open(encrypted_path, 'wb') as f:
-            torch.save(package, f)
+            f.write(header)
+            f.write(nonce)
+            f.write(encrypted_data)
         
         print(f"✅ Model encrypted successfully")
         print(f"   Original size: {len(model_data) / 1024 / 1024:.2f} MB")
         print(f"   Encrypted size: {len(encrypted_data) / 1024 / 1024:.2f} MB")
-        print(f"   Hash: {metadata['hash'][:16]}...")
+        print(f"   Cipher: {metadata['cipher']}")
         
         return encrypted_path
     
@@ -87,8 +127,157 @@ class ModelEncryption:
         Returns:
             Decrypted model data (bytes)
         """
-        # Load encrypted package
-        package = torch.load(encrypted_path, map_location='cpu')
+        return self.decrypt_model_to_buffer(encrypted_path).getvalue()
+    
+    def read_metadata(self, encrypted_path):
+        """
+        Header metadata of a v3 (AES-GCM) model without decrypting it
+        
+        The header is only authenticated on decryption, so use this for
+        cache decisions (e.g. the plaintext 'sha256'), not for trust.
+        
+        Args:
+            encrypted_path: Path to encrypted model
+            
+        Returns:
+            Metadata dict, or None for legacy files
+        """
+        with open(encrypted_path, 'rb') as f:
+            header = self._read_gcm_header(f)
+            if header is None:
+                return None
+            
+            return json.loads(header[len(GCM_MAGIC) + 4:])
+    
+    def get_decrypted_size(self, encrypted_path):
+        """
+        Exact plaintext size of a v3 (AES-GCM) model, read from the file size
+        
+        Args:
+            encrypted_path: Path to encrypted model
+            
+        Returns:
+            Size in bytes, or None for v2/legacy files
+        """
+        with open(encrypted_path, 'rb') as f:
+            header = self._read_gcm_header(f)
+            if header is None:
+                return None
+            
+            return os.fstat(f.fileno()).st_size - len(header) - GCM_NONCE_SIZE - GCM_TAG_SIZE
+    
+    def decrypt_model_into(self, encrypted_path, out):
+        """
+        Decrypt a v3 (AES-GCM) model directly into a preallocated buffer
+        
+        Ciphertext is streamed in CHUNK_SIZE pieces and update_into writes the
+        plaintext straight into out, so neither the full ciphertext nor an
+        intermediate plaintext copy is held in memory. The tag is checked at
+        the end; on failure out must be discarded.
+        
+        Args:
+            encrypted_path: Path to encrypted model
+            out: Writable buffer (bytearray, mmap) of get_decrypted_size() bytes
+        """
+        with open(encrypted_path, 'rb') as f:
+            header = self._read_gcm_header(f)
+            if header is None:
+                raise ValueError("decrypt_model_into requires an AES-GCM (v3) model")
+            
+            nonce = f.read(GCM_NONCE_SIZE)
+            start = f.tell()
+            size = os.fstat(f.fileno()).st_size - start - GCM_TAG_SIZE
+            if size < 0 or size != len(out):
+                raise ValueError("Encrypted model is truncated or corrupted")
+            
+            f.seek(start + size)
+            tag = f.read(GCM_TAG_SIZE)
+            f.seek(start)
+            
+            decryptor = Cipher(algorithms.AES(self.gcm_key), modes.GCM(nonce, tag)).decryptor()
+            decryptor.authenticate_additional_data(header)
+            
+            out_view = memoryview(out)
+            chunk = memoryview(bytearray(CHUNK_SIZE))
+            pos = 0
+            while pos < size:
+                n = f.readinto(chunk[:min(CHUNK_SIZE, size - pos)])
+                if not n:
+                    raise ValueError("Encrypted model is truncated or corrupted")
+                
+                # update_into needs block_size - 1 bytes of slack past the data
+                if size - pos >= n + 15:
+                    decryptor.update_into(chunk[:n], out_view[pos:])
+                else:
+                    out_view[pos:pos + n] = decryptor.update(chunk[:n])
+                pos += n
+            
+            try:
+                decryptor.finalize()
+            except InvalidTag:
+                raise ValueError("Model integrity check failed - possible tampering")
+    
+    def _read_gcm_header(self, f):
+        """Return the authenticated v3 header, or None (file rewound) for other formats"""
+        magic = f.read(len(GCM_MAGIC))
+        if magic != GCM_MAGIC:
+            f.seek(0)
+            return None
+        
+        size_bytes = f.read(4)
+        try:
+            (metadata_size,) = struct.unpack('>I', size_bytes)
+        except struct.error:
+            raise ValueError("Encrypted model is truncated or corrupted")
+        
+        metadata_bytes = f.read(metadata_size)
+        if len(metadata_bytes) != metadata_size:
+            raise ValueError("Encrypted model is truncated or corrupted")
+        
+        return magic + size_bytes + metadata_bytes
+    
+    def decrypt_model_to_buffer(self, encrypted_path):
+        """
+        Decrypt model into an in-memory file object for torch.load / torch.jit.load
+        
+        Args:
+            encrypted_path: Path to encrypted model
+            
+        Returns:
+            io.BytesIO positioned at the start of the decrypted model
+        """
+        with open(encrypted_path, 'rb') as f:
+            header = self._read_gcm_header(f)
+            if header is None:
+                return io.BytesIO(self._decrypt_legacy(encrypted_path))
+            
+            return self._decrypt_gcm(f, header)
+    
+    def _decrypt_gcm(self, f, header):
+        """
+        AES-GCM: decryption and authentication in one AES-NI/PCLMULQDQ pass;
+        the tag replaces the separate SHA256 check
+        """
+        nonce = f.read(GCM_NONCE_SIZE)
+        encrypted_data = f.read()
+        
+        try:
+            decrypted_data = AESGCM(self.gcm_key).decrypt(nonce, encrypted_data, header)
+        except InvalidTag:
+            raise ValueError("Model integrity check failed - possible tampering")
+        
+        return io.BytesIO(decrypted_data)
+    
+    def _decrypt_legacy(self, encrypted_path):
+        """Decrypt a v1 torch.save package (re-run encryption to upgrade)"""
+        import torch  # only legacy packages need torch
+        
+        # Load encrypted package (plain dicts/str/bytes, so the weights-only
+        # unpickler suffices; anything else is not a model package)
+        try:
+            package = torch.load(encrypted_path, map_location='cpu', weights_only=True)
+        except Exception as e:
+            raise ValueError(f"Not a valid encrypted model: {e}") from e
         
         # Decrypt
         decrypted_data = self.cipher.decrypt(package['data'])
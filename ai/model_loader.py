@@ -5,14 +5,106 @@ Loads encrypted models with integrity verification
 
 import torch
 import torch.nn as nn
-import io
+import inspect
+import mmap
 import os
+import pickle
 from model_encryption import ModelEncryption
 
+# PyTorch >= 2.1: modules can adopt loaded tensors instead of copying into them
+ASSIGN_SUPPORTED = 'assign' in inspect.signature(nn.Module.load_state_dict).parameters
+
+def checkpoint_safe_globals():
+    """numpy callables that appear in checkpoint metadata (e.g. best_metric scalars)"""
+    import numpy as np
+    scalar_types = (np.int64, np.float32, np.float64, np.bool_)
+    return [np.dtype, np.core.multiarray.scalar] + [type(np.dtype(t)) for t in scalar_types]
+
+# Allowlist them for the weights-only unpickler once, at import. Requires
+# PyTorch >= 2.4 (pinned in requirements.txt / Dockerfile); older versions
+# only accept tensors and plain containers.
+SAFE_GLOBALS_SUPPORTED = hasattr(torch.serialization, 'add_safe_globals')
+if SAFE_GLOBALS_SUPPORTED:
+    torch.serialization.add_safe_globals(checkpoint_safe_globals())
+
+def _create_memfd(size):
+    """
+    Anonymous in-memory file (Linux memfd) of the given size, so torch.load
+    can mmap decrypted weights without them ever touching a filesystem
+    
+    Returns:
+        File descriptor, or None if memfd_create is unavailable
+    """
+    if not hasattr(os, 'memfd_create'):
+        return None
+    
+    try:
+        fd = os.memfd_create('plant-model', os.MFD_CLOEXEC)
+        os.ftruncate(fd, size)
+    except OSError:
+        return None
+    
+    return fd
+
+def load_weights_only(source, device, **kwargs):
+    """torch.load with the weights-only unpickler (never downgraded to full pickle)"""
+    try:
+        return torch.load(source, map_location=device, weights_only=True, **kwargs)
+    except pickle.UnpicklingError as e:
+        if not SAFE_GLOBALS_SUPPORTED:
+            raise ValueError(
+                f"PyTorch {torch.__version__} cannot allowlist the numpy metadata in this "
+                "checkpoint; install torch>=2.4 or re-save it as a plain state_dict "
+                f"(torch.save(checkpoint['model_state_dict'], path)): {e}"
+            ) from e
+        raise ValueError(
+            "Checkpoint contains objects outside the weights-only allowlist; "
+            f"re-save it as a plain state_dict: {e}"
+        ) from e
+
 class SecureModelLoader:
     def __init__(self, key_path='./secrets/model.key'):
         self.encryptor = ModelEncryption(key_path)
     
+    def load_checkpoint(self, encrypted_path, device='cpu'):
+        """
+        Decrypt and load a checkpoint
+        
+        AES-GCM models are decrypted straight into a memfd mapping and loaded
+        with mmap=True, so tensor storages map those pages and the plaintext
+        never exists in the Python heap. Other formats, or hosts without
+        memfd, fall back to an in-memory BytesIO load.
+        
+        Args:
+            encrypted_path: Path to encrypted model
+            device: Device to map tensors to
+            
+        Returns:
+            Loaded checkpoint
+        """
+        size = self.encryptor.get_decrypted_size(encrypted_path)
+        fd = _create_memfd(size) if size else None
+        
+        if fd is None:
+            # Decrypt straight into memory (never write to disk)
+            buffer = self.encryptor.decrypt_model_to_buffer(encrypted_path)
+            return load_weights_only(buffer, device)
+        
+        path = f"/proc/self/fd/{fd}"
+        
+        try:
+            with mmap.mmap(fd, size) as out:
+                self.encryptor.decrypt_model_into(encrypted_path, out)
+            
+            try:
+                return load_weights_only(path, device, mmap=True)
+            except RuntimeError:
+                # mmap needs the zipfile serialization format
+                with open(path, 'rb') as f:
+                    return load_weights_only(f, device)
+        finally:
+            os.close(fd)
+    
     def load_encrypted_model(self, encrypted_path, model_class, device='cpu'):
         """
         Load and decrypt model
@@ -25,42 +117,47 @@ class SecureModelLoader:
         Returns:
             Loaded model
         """
-        # Decrypt model data
-        decrypted_data = self.encryptor.decrypt_model(encrypted_path)
-        
-        # Load from memory (never write to disk)
-        buffer = io.BytesIO(decrypted_data)
+        checkpoint = self.load_checkpoint(encrypted_path, device)
         
-        try:
-            # Try new PyTorch format
-            import numpy as np
-            safe_globals = [
-                np.dtype, np.int64, np.float32, np.float64,
-                np.bool_, np.core.multiarray.scalar
-            ]
-            
-            with torch.serialization.safe_globals(safe_globals):
-                checkpoint = torch.load(buffer, map_location=device, weights_only=False)
-        except (AttributeError, TypeError):
-            # Fallback for older PyTorch
-            checkpoint = torch.load(buffer, map_location=device)
+        if not isinstance(checkpoint, dict):
+            raise ValueError("Unexpected checkpoint format")
         
-        # Create model
-        model = model_class()
+        if 'model_state_dict' in checkpoint:
+            state_dict = checkpoint['model_state_dict']
+        elif 'state_dict' in checkpoint:
+            state_dict = checkpoint['state_dict']
+        else:
+            state_dict = checkpoint
         
-        # Load weights
-        if isinstance(checkpoint, dict):
-            if 'model_state_dict' in checkpoint:
-                model.load_state_dict(checkpoint['model_state_dict'])
-            elif 'state_dict' in checkpoint:
-                model.load_state_dict(checkpoint['state_dict'])
-            else:
-                model.load_state_dict(checkpoint)
+        if ASSIGN_SUPPORTED:
+            # Build on the meta device (no allocation or init), then adopt
+            # the loaded tensors in place of parameters and buffers
+            with torch.device('meta'):
+                model = model_class()
+            model.load_state_dict(state_dict, strict=True, assign=True)
         else:
-            raise ValueError("Unexpected checkpoint format")
+            model = model_class()
+            model.load_state_dict(state_dict, strict=True)
         
         model.to(device)
         model.eval()
         
         return model
-    
\ No newline at end of file
+    
+    def load_encrypted_scripted_model(self, encrypted_path, device='cpu'):
+        """
+        Load and decrypt a frozen TorchScript module
+        
+        Args:
+            encrypted_path: Path to encrypted .ptc artifact
+            device: Device to load model on
+            
+        Returns:
+            Loaded TorchScript module
+        """
+        # Load from memory (never write to disk)
+        buffer = self.encryptor.decrypt_model_to_buffer(encrypted_path)
+        model = torch.jit.load(buffer, map_location=device)
+        model.eval()
+        
+        return model
@@ -0,0 +1,611 @@
+"""
+Model Optimizer
+Prepares a loaded PlantHealthModel for fast inference
+(channels_last layout, FP16 autocast, INT8 on CPU, TorchScript freeze + warmup,
+CUDA Graphs, optional torch.compile, optional ONNX Runtime / TensorRT)
+"""
+
+import contextlib
+import hashlib
+import io
+import os
+import re
+import sys
+import numpy as np
+import torch
+import torch.nn as nn
+
+# Fixed inference input shape (batch, channels, height, width)
+INPUT_SHAPE = (1, 3, 224, 224)
+
+# Set USE_TORCHSCRIPT=0 to keep the eager model (debugging)
+USE_TORCHSCRIPT = os.getenv('USE_TORCHSCRIPT', '1') == '1'
+
+# Set USE_CUDA_GRAPHS=0 to disable graph capture on GPU
+USE_CUDA_GRAPHS = os.getenv('USE_CUDA_GRAPHS', '1') == '1'
+
+# Set USE_INT8=0 to keep the classifier head in FP32 on CPU
+USE_INT8 = os.getenv('USE_INT8', '1') == '1'
+
+# Set USE_TORCH_COMPILE=1 to use torch.compile (Inductor + CUDA graphs) instead
+# of TorchScript + CUDAGraphRunner on GPU (requires PyTorch >= 2.1)
+USE_TORCH_COMPILE = os.getenv('USE_TORCH_COMPILE', '0') == '1'
+
+# Batch sizes torch.compile specializes for (comma-separated); other batches
+# are zero-padded up to the next compiled size or split into chunks
+COMPILE_BATCH_SIZES = sorted({
+    int(size) for size in os.getenv('COMPILE_BATCH_SIZES', '1').split(',') if size.strip()
+})
+
+# Set USE_ONNX=1 to run an exported ONNX model through ONNX Runtime
+USE_ONNX = os.getenv('USE_ONNX', '0') == '1'
+ONNX_OPSET = 17
+TRT_ENGINE_CACHE_PATH = os.getenv('TRT_ENGINE_CACHE_PATH', './saved_models/trt_cache')
+
+# Derived artifacts (.ptc, .onnx) record the SHA-256 of the checkpoint they
+# were built from under this key; a mismatch on load means rebuild
+CHECKPOINT_DIGEST_KEY = 'checkpoint_sha256'
+
+
+def _log(message):
+    """Log to stderr (stdout is reserved for JSON responses)"""
+    sys.stderr.write(message + "\n")
+    sys.stderr.flush()
+
+
+def configure_device(device):
+    """Enable cuDNN autotuning and TF32 on GPU"""
+    if device.type == 'cuda':
+        torch.backends.cudnn.benchmark = True
+        if hasattr(torch.backends.cuda.matmul, 'allow_tf32'):
+            torch.backends.cuda.matmul.allow_tf32 = True
+        if hasattr(torch.backends.cudnn, 'allow_tf32'):
+            torch.backends.cudnn.allow_tf32 = True
+
+
+def to_channels_last(model):
+    """Convert conv weights to NHWC (faster depthwise/pointwise convs)"""
+    return model.to(memory_format=torch.channels_last)
+
+
+def prepare_input(img, device):
+    """Move an NCHW batch to the device in channels_last layout"""
+    img = img.to(device, non_blocking=True)
+    return img.contiguous(memory_format=torch.channels_last)
+
+
+def allocate_input_buffer(device, batch_size=1):
+    """
+    Host staging buffer for preprocessed images
+
+    The tensor is channels_last (physically NHWC), so HWC images are written
+    into the returned NumPy view without a transpose. On CUDA it is pinned so
+    the host-to-device copy can run with non_blocking=True.
+
+    Returns:
+        (tensor of shape (batch_size, 3, H, W), NumPy view of shape (batch_size, H, W, 3))
+    """
+    shape = (batch_size,) + INPUT_SHAPE[1:]
+    buffer = torch.empty(
+        shape,
+        dtype=torch.float32,
+        memory_format=torch.channels_last,
+        pin_memory=device.type == 'cuda'
+    )
+    return buffer, buffer.permute(0, 2, 3, 1).numpy()
+
+
+def allocate_output_buffers(device, batch_size, num_classes):
+    """
+    Pinned host buffers for the sorted probabilities and class indices
+
+    Returns:
+        (float32 tensor, int64 tensor) of shape (batch_size, num_classes),
+        or None on CPU where results are already on the host
+    """
+    if device.type != 'cuda':
+        return None
+
+    shape = (batch_size, num_classes)
+    return (
+        torch.empty(shape, dtype=torch.float32, pin_memory=True),
+        torch.empty(shape, dtype=torch.int64, pin_memory=True)
+    )
+
+
+def copy_to_host(tensors, host_buffers):
+    """
+    Copy result tensors to the host with non_blocking copies into pinned
+    buffers and a single stream synchronize (instead of one blocking
+    transfer per tensor). Falls back to .cpu() without buffers or when
+    the batch does not fit.
+    """
+    batch_size = tensors[0].shape[0]
+    if host_buffers is None or host_buffers[0].shape[0] < batch_size:
+        return [t.cpu() for t in tensors]
+
+    views = []
+    for tensor, host in zip(tensors, host_buffers):
+        view = host[:batch_size]
+        view.copy_(tensor, non_blocking=True)
+        views.append(view)
+    torch.cuda.current_stream().synchronize()
+    return views
+
+
+def inference_autocast(device, cache_enabled=True):
+    """FP16 autocast on CUDA (Tensor Cores); CPU keeps running in FP32"""
+    if device.type == 'cuda':
+        return torch.autocast(
+            device_type='cuda',
+            dtype=torch.float16,
+            cache_enabled=cache_enabled
+        )
+    return contextlib.nullcontext()
+
+
+def warmup_model(model, device, iterations=2, batch_size=1):
+    """Run dummy forwards so the JIT profiling executor specializes the graph"""
+    dummy = prepare_input(torch.zeros((batch_size,) + INPUT_SHAPE[1:]), device)
+    with torch.inference_mode(), inference_autocast(device):
+        for _ in range(iterations):
+            model(dummy)
+
+
+def torch_version():
+    """(major, minor) of the installed PyTorch"""
+    match = re.match(r'(\d+)\.(\d+)', torch.__version__)
+    return (int(match.group(1)), int(match.group(2))) if match else (0, 0)
+
+
+def use_torch_compile(device):
+    """True if the torch.compile path should replace TorchScript on this device"""
+    return (
+        USE_TORCH_COMPILE and
+        device.type == 'cuda' and
+        hasattr(torch, 'compile') and
+        torch_version() >= (2, 1)
+    )
+
+
+def is_compiled(model):
+    """True for torch.compile output (it already replays CUDA graphs)"""
+    return isinstance(model, CompiledBatchRunner) or hasattr(model, '_orig_mod')
+
+
+class CompiledBatchRunner:
+    """
+    Runs a torch.compile'd model on the fixed batch sizes it was compiled for
+
+    A batch is zero-padded up to the smallest compiled size that fits and the
+    padding rows are dropped from the output; batches above the largest size
+    are run in chunks of that size. Rows are independent in eval mode, so
+    padding does not change the real rows' results.
+    """
+
+    def __init__(self, compiled, batch_sizes):
+        self.compiled = compiled
+        self.batch_sizes = batch_sizes
+
+    def _run(self, x):
+        batch_size = x.shape[0]
+        target = next(size for size in self.batch_sizes if size >= batch_size)
+        if target > batch_size:
+            padding = x.new_zeros((target - batch_size,) + tuple(x.shape[1:]))
+            x = torch.cat([x, padding]).contiguous(memory_format=torch.channels_last)
+        return self.compiled(x)[:batch_size]
+
+    def __call__(self, x):
+        largest = self.batch_sizes[-1]
+        if x.shape[0] <= largest:
+            return self._run(x)
+
+        # CUDA-graph outputs are overwritten by the next replay, so clone each chunk
+        return torch.cat([
+            self._run(chunk).clone() for chunk in torch.split(x, largest)
+        ])
+
+
+def compile_model(model, device, max_batch_size=1):
+    """
+    Compile an eval-mode model with Inductor in reduce-overhead mode
+
+    dynamic=False bakes each input shape into its own fused graph, so one
+    graph is compiled (and CUDA-graph captured) per batch size. Only the
+    COMPILE_BATCH_SIZES up to max_batch_size are compiled, here at startup;
+    CompiledBatchRunner maps every other batch onto them.
+
+    Returns:
+        Compiled and warmed-up model, or None if compilation fails
+    """
+    batch_sizes = [size for size in COMPILE_BATCH_SIZES if 0 < size <= max_batch_size] or [1]
+
+    try:
+        import torch._dynamo
+        dynamo_config = torch._dynamo.config
+        dynamo_config.cache_size_limit = max(dynamo_config.cache_size_limit, len(batch_sizes))
+
+        compiled = torch.compile(model, mode='reduce-overhead', fullgraph=False, dynamic=False)
+        # Three calls per shape: compile, CUDA-graph record, first replay
+        for batch_size in batch_sizes:
+            warmup_model(compiled, device, iterations=3, batch_size=batch_size)
+        return CompiledBatchRunner(compiled, batch_sizes)
+    except Exception as e:
+        _log(f"⚠️  torch.compile failed, falling back to TorchScript: {e}")
+        return None
+
+
+def uses_int8(device):
+    """True if models for this device get INT8 dynamic quantization"""
+    return device.type == 'cpu' and USE_INT8
+
+
+class PerSampleLinear(nn.Module):
+    """
+    Runs a dynamically quantized Linear one row at a time
+
+    Dynamic quantization picks one activation scale per input tensor, so on
+    a micro-batch each image's logits would depend on the other images in
+    the batch. Quantizing row by row keeps results identical to batch size
+    1; the head is tiny next to the backbone, so the loop is cheap.
+    """
+
+    def __init__(self, linear):
+        super().__init__()
+        self.linear = linear
+
+    def forward(self, x):
+        rows = [self.linear(x[i:i + 1]) for i in range(x.shape[0])]
+        return torch.cat(rows)
+
+
+def _quantize_per_sample(module):
+    """Wrap every dynamic INT8 Linear below module in a PerSampleLinear"""
+    for name, child in module.named_children():
+        if isinstance(child, torch.ao.nn.quantized.dynamic.Linear):
+            setattr(module, name, PerSampleLinear(child))
+        else:
+            _quantize_per_sample(child)
+
+
+def quantize_for_cpu(model, device):
+    """
+    Dynamic INT8 quantization of the nn.Linear layers (classifier head) on CPU.
+    No calibration needed; weights are INT8, activations quantized on the fly
+    per sample (fbgemm VNNI GEMMs on x86). GPU models are returned unchanged.
+    """
+    if not uses_int8(device):
+        return model
+
+    engines = torch.backends.quantized.supported_engines
+    if 'fbgemm' in engines:
+        torch.backends.quantized.engine = 'fbgemm'
+    elif 'qnnpack' in engines:
+        torch.backends.quantized.engine = 'qnnpack'
+    else:
+        return model
+
+    try:
+        quantized = torch.quantization.quantize_dynamic(model, {nn.Linear}, dtype=torch.qint8)
+    except Exception as e:
+        _log(f"⚠️  INT8 quantization failed, keeping FP32 model: {e}")
+        return model
+
+    _quantize_per_sample(quantized)
+    return quantized
+
+
+def script_model(model):
+    """
+    Script and freeze an eval-mode model. This is the form persisted as .ptc:
+    optimize_for_inference output cannot be reloaded, so it is applied after load.
+    """
+    scripted = torch.jit.script(model)
+    return torch.jit.freeze(scripted)
+
+
+def finalize_scripted_model(frozen, device):
+    """Run optimize_for_inference on a frozen module and warm it up"""
+    model = torch.jit.optimize_for_inference(frozen)
+    warmup_model(model, device)
+    return model
+
+
+def get_scripted_path(model_path, device):
+    """
+    Path of the frozen TorchScript artifact stored next to a checkpoint.
+    Frozen graphs are device specific and bake in INT8 quantization, so the
+    device type and quantization mode are part of the name
+    (e.g. best_model.cpu.int8.ptc); changing USE_INT8 selects another file.
+    """
+    base, _ = os.path.splitext(model_path)
+    suffix = '.int8' if uses_int8(device) else ''
+    return f"{base}.{device.type}{suffix}.ptc"
+
+
+def file_digest(path):
+    """SHA-256 (hex) of a file's contents"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def is_artifact_fresh(artifact_digest, checkpoint_digest):
+    """True if an artifact records the digest of the current checkpoint"""
+    return checkpoint_digest is not None and artifact_digest == checkpoint_digest
+
+
+def has_scripted_model(model_path, device):
+    """True if TorchScript is the selected path and a frozen artifact exists"""
+    return (
+        USE_TORCHSCRIPT and
+        not use_torch_compile(device) and
+        os.path.exists(get_scripted_path(model_path, device))
+    )
+
+
+def load_scripted_model(source, device, checkpoint_digest):
+    """
+    Load a frozen TorchScript artifact from a path or file-like object
+
+    Args:
+        source: .ptc path or file-like object
+        device: Inference device
+        checkpoint_digest: SHA-256 of the checkpoint the artifact must come from
+
+    Returns:
+        Finalized module, or None if the artifact was built from another
+        checkpoint (the caller rebuilds it)
+    """
+    extra_files = {CHECKPOINT_DIGEST_KEY: ''}
+    model = torch.jit.load(source, map_location=device, _extra_files=extra_files)
+    if not is_artifact_fresh(extra_files[CHECKPOINT_DIGEST_KEY].decode(), checkpoint_digest):
+        _log("⚠️  TorchScript artifact does not match the checkpoint, rebuilding")
+        return None
+
+    model.eval()
+    return finalize_scripted_model(model, device)
+
+
+def optimize_model(model, device, save_path=None, max_batch_size=1, checkpoint_digest=None):
+    """
+    Quantize (CPU only) and convert an eval-mode model to frozen TorchScript,
+    or compile it with torch.compile when USE_TORCH_COMPILE=1 on GPU
+
+    Args:
+        model: Eager model (already on device, in eval mode)
+        device: Inference device
+        save_path: Optional path to persist the frozen module
+        max_batch_size: Largest batch the caller will run (torch.compile only)
+        checkpoint_digest: SHA-256 of the source checkpoint, stored with save_path
+
+    Returns:
+        Compiled or frozen TorchScript module, or the eager model if both fail
+    """
+    if use_torch_compile(device):
+        compiled = compile_model(model, device, max_batch_size)
+        if compiled is not None:
+            return compiled
+
+    model = quantize_for_cpu(model, device)
+
+    if not USE_TORCHSCRIPT:
+        return model
+
+    try:
+        frozen = script_model(model)
+    except Exception as e:
+        _log(f"⚠️  TorchScript conversion failed, using eager model: {e}")
+        return model
+
+    if save_path:
+        try:
+            extra_files = {CHECKPOINT_DIGEST_KEY: checkpoint_digest or ''}
+            torch.jit.save(frozen, save_path, _extra_files=extra_files)
+        except (OSError, RuntimeError) as e:
+            # torch.jit.save reports unwritable paths (e.g. a read-only
+            # saved_models mount) as RuntimeError; the cache is optional
+            _log(f"⚠️  Could not save TorchScript model to {save_path}: {e}")
+
+    try:
+        return finalize_scripted_model(frozen, device)
+    except Exception as e:
+        _log(f"⚠️  TorchScript optimization failed, using eager model: {e}")
+        return model
+
+
+class CUDAGraphRunner:
+    """
+    Replays captured CUDA graphs instead of launching every kernel per request.
+    One graph per batch size (1..max_batch_size) is captured at startup, all
+    sharing one memory pool; larger batches fall back to the wrapped model.
+
+    Sharing the pool keeps activation memory at the largest graph's footprint
+    rather than the sum over batch sizes. It is safe because replays are
+    never concurrent: one graph's scratch memory may back another graph's
+    output, so the returned tensor is only valid until the next call and
+    callers must consume it (softmax/copy) before running again.
+    """
+
+    def __init__(self, model, device, max_batch_size=1):
+        self.model = model
+        self.device = device
+        self.max_batch_size = max_batch_size
+        self._graphs = {}
+        self._pool = torch.cuda.graph_pool_handle()
+        for batch_size in range(1, max_batch_size + 1):
+            self._capture(batch_size)
+
+    def _capture(self, batch_size):
+        shape = (batch_size,) + INPUT_SHAPE[1:]
+        static_in = prepare_input(torch.zeros(shape), self.device)
+
+        # Warm up on a side stream (required before capture)
+        stream = torch.cuda.Stream()
+        stream.wait_stream(torch.cuda.current_stream())
+        with torch.cuda.stream(stream), torch.inference_mode(), \
+                inference_autocast(self.device, cache_enabled=False):
+            for _ in range(3):
+                self.model(static_in)
+        torch.cuda.current_stream().wait_stream(stream)
+
+        graph = torch.cuda.CUDAGraph()
+        with torch.inference_mode(), inference_autocast(self.device, cache_enabled=False):
+            with torch.cuda.graph(graph, pool=self._pool):
+                static_out = self.model(static_in)
+
+        self._graphs[batch_size] = (graph, static_in, static_out)
+
+    def __call__(self, x):
+        batch_size = x.shape[0]
+        if batch_size > self.max_batch_size:
+            return self.model(x)
+
+        graph, static_in, static_out = self._graphs[batch_size]
+        static_in.copy_(x, non_blocking=True)
+        graph.replay()
+        return static_out
+
+
+def capture_cuda_graph(model, device, max_batch_size=1):
+    """Wrap model in a CUDAGraphRunner on GPU; returns model unchanged otherwise"""
+    if device.type != 'cuda' or not USE_CUDA_GRAPHS or is_compiled(model):
+        return model
+
+    try:
+        return CUDAGraphRunner(model, device, max_batch_size)
+    except Exception as e:
+        _log(f"⚠️  CUDA graph capture failed, launching kernels per request: {e}")
+        return model
+
+
+def get_onnx_path(model_path):
+    """Path of the ONNX export stored next to a checkpoint"""
+    base, _ = os.path.splitext(model_path)
+    return f"{base}.onnx"
+
+
+def export_onnx(model, destination, checkpoint_digest):
+    """
+    Export an eager FP32 model to ONNX
+
+    The batch axis stays dynamic so micro-batched requests can share a
+    session; height/width are fixed at 224 for TensorRT specialization.
+    checkpoint_digest is stored in the model's metadata_props.
+    """
+    import onnx
+
+    device = next(model.parameters()).device
+    dummy = torch.zeros(*INPUT_SHAPE, device=device)
+    buffer = io.BytesIO()
+    torch.onnx.export(
+        model,
+        dummy,
+        buffer,
+        opset_version=ONNX_OPSET,
+        input_names=['x'],
+        output_names=['logits'],
+        dynamic_axes={'x': {0: 'batch'}, 'logits': {0: 'batch'}}
+    )
+
+    proto = onnx.load_from_string(buffer.getvalue())
+    onnx.helper.set_model_props(proto, {CHECKPOINT_DIGEST_KEY: checkpoint_digest})
+    onnx.save(proto, destination)
+
+
+class OnnxRunner:
+    """
+    Runs an ONNX model through ONNX Runtime, preferring TensorRT (FP16),
+    then CUDA, then CPU. Called like the PyTorch model: takes an NCHW batch
+    tensor and returns logits as a CPU tensor.
+
+    TensorRT engines embed the weights unencrypted, so the engine cache is
+    only enabled for plaintext models (cache_engines=True).
+    """
+
+    def __init__(self, source, cache_engines=True):
+        import onnxruntime as ort
+
+        trt_options = {'trt_fp16_enable': True}
+        if cache_engines:
+            trt_options['trt_engine_cache_enable'] = True
+            trt_options['trt_engine_cache_path'] = TRT_ENGINE_CACHE_PATH
+
+        preferred = [
+            ('TensorrtExecutionProvider', trt_options),
+            'CUDAExecutionProvider',
+            'CPUExecutionProvider'
+        ]
+        available = ort.get_available_providers()
+        providers = [
+            p for p in preferred
+            if (p[0] if isinstance(p, tuple) else p) in available
+        ]
+
+        # source is a file path or the raw (decrypted) model bytes
+        self.session = ort.InferenceSession(source, providers=providers)
+        self.input_name = self.session.get_inputs()[0].name
+        self.output_name = self.session.get_outputs()[0].name
+        self.on_gpu = self.session.get_providers()[0] in (
+            'TensorrtExecutionProvider', 'CUDAExecutionProvider'
+        )
+
+    def __call__(self, x):
+        x = x.float().contiguous()
+
+        if x.is_cuda and self.on_gpu:
+            # IOBinding: ONNX Runtime reads the batch in place on the GPU
+            # instead of a device-to-host-to-device round trip
+            torch.cuda.current_stream().synchronize()
+            binding = self.session.io_binding()
+            binding.bind_input(
+                name=self.input_name,
+                device_type='cuda',
+                device_id=x.device.index or 0,
+                element_type=np.float32,
+                shape=tuple(x.shape),
+                buffer_ptr=x.data_ptr()
+            )
+            binding.bind_output(self.output_name, 'cpu')
+            self.session.run_with_iobinding(binding)
+            return torch.from_numpy(binding.copy_outputs_to_cpu()[0])
+
+        logits = self.session.run(None, {self.input_name: x.cpu().numpy()})[0]
+        return torch.from_numpy(logits)
+
+
+def load_onnx_model(source, checkpoint_digest, cache_engines=True):
+    """
+    Create an OnnxRunner when USE_ONNX=1 and onnxruntime is installed
+
+    Args:
+        source: ONNX file path or decrypted model bytes
+        checkpoint_digest: SHA-256 of the checkpoint the export must come from
+        cache_engines: Persist TensorRT engines (must be False for encrypted models)
+
+    Returns:
+        OnnxRunner, or None so the caller falls back to PyTorch
+    """
+    if not USE_ONNX:
+        return None
+
+    try:
+        import onnxruntime  # noqa: F401
+    except ImportError:
+        _log("⚠️  USE_ONNX=1 but onnxruntime is not installed, using PyTorch")
+        return None
+
+    try:
+        runner = OnnxRunner(source, cache_engines)
+        metadata = runner.session.get_modelmeta().custom_metadata_map
+        if not is_artifact_fresh(metadata.get(CHECKPOINT_DIGEST_KEY), checkpoint_digest):
+            _log("⚠️  ONNX export does not match the checkpoint, using PyTorch")
+            return None
+
+        runner(torch.zeros(*INPUT_SHAPE))
+        return runner
+    except Exception as e:
+        _log(f"⚠️  ONNX Runtime session failed, using PyTorch: {e}")
+        return None
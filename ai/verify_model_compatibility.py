@@ -4,9 +4,13 @@ Checks if your trained model can be loaded by the backend inference script
 """
 
 import torch
-import timm
 import sys
 import os
+from inference import CONFIG, PlantHealthModel
+from model_loader import load_weights_only
+
+# Backbone names the backend's PlantHealthModel can load
+COMPATIBLE_MODEL_NAMES = ('efficientnet_b2', 'tf_efficientnet_b2')
 
 def check_model_architecture():
     """Verify model architecture matches"""
@@ -28,13 +32,9 @@ def check_model_architecture():
     
     print(f"\n✓ Found model: {model_path}")
     
-    # Load checkpoint
+    # Load checkpoint (weights-only; mmap keeps tensor storages lazy)
     try:
-        checkpoint = torch.load(
-            model_path,
-            map_location='cpu',
-            weights_only=False
-        )
+        checkpoint = load_weights_only(model_path, 'cpu', mmap=True)
 
         print("✓ Checkpoint loaded successfully")
     except Exception as e:
@@ -57,62 +57,54 @@ def check_model_architecture():
     # Try efficientnet_b2 (correct)
     print("\n1. Testing efficientnet_b2 (CORRECT):")
     try:
-        test_model = timm.create_model('efficientnet_b2', pretrained=False, num_classes=0)
-        feature_dim = test_model.num_features
+        # Built on the meta device (same config as the backend): parameter
+        # names and shapes only, no weights
+        with torch.device('meta'):
+            expected_model = PlantHealthModel(
+                model_name=CONFIG['model']['name'],
+                num_classes=CONFIG['model']['num_classes'],
+                dropout=CONFIG['model']['dropout']
+            )
         print(f"   ✓ Model created successfully")
-        print(f"   ✓ Feature dimension: {feature_dim}")
+        print(f"   ✓ Feature dimension: {expected_model.base_model.num_features}")
+        
+        # Compare key sets (the mmap-ed checkpoint tensors are never read)
+        expected_keys = set(expected_model.state_dict().keys())
+        checkpoint_keys = set(checkpoint['model_state_dict'].keys())
+        missing = sorted(expected_keys - checkpoint_keys)
+        unexpected = sorted(checkpoint_keys - expected_keys)
         
-        # Try loading weights
-        from inference import PlantHealthModel
-        full_model = PlantHealthModel('efficientnet_b2', 7, 0.2)
-        full_model.load_state_dict(checkpoint['model_state_dict'])
-        print(f"   ✓ Weights loaded successfully!")
-        print(f"   ✅ THIS IS THE CORRECT MODEL!")
+        if missing or unexpected:
+            print(f"   ❌ State dict keys differ ({len(missing)} missing, {len(unexpected)} unexpected)")
+            for key in missing[:5]:
+                print(f"      missing: {key}")
+            for key in unexpected[:5]:
+                print(f"      unexpected: {key}")
+        else:
+            print(f"   ✓ All {len(expected_keys)} state dict keys match!")
+            
+            # Shapes too: adopt the mmap-ed tensors instead of copying them
+            expected_model.load_state_dict(checkpoint['model_state_dict'], strict=True, assign=True)
+            print(f"   ✓ Weights loaded successfully!")
+            print(f"   ✅ THIS IS THE CORRECT MODEL!")
         
     except Exception as e:
         print(f"   ❌ Failed: {e}")
     
-    # Try efficientnetv2_b2 (incorrect - will fail)
-    print("\n2. Testing efficientnetv2_b2 (INCORRECT):")
-    try:
-        test_model = timm.create_model('efficientnetv2_b2', pretrained=False, num_classes=0)
-        feature_dim = test_model.num_features
-        print(f"   ⚠️  Model created (feature dim: {feature_dim})")
-        
-        # Try loading weights - THIS WILL FAIL
-        class TestModel(torch.nn.Module):
-            def __init__(self):
-                super().__init__()
-                self.base_model = timm.create_model('efficientnetv2_b2', pretrained=False, num_classes=0)
-                fd = self.base_model.num_features
-                self.classifier = torch.nn.Sequential(
-                    torch.nn.BatchNorm1d(fd),
-                    torch.nn.Dropout(0.2),
-                    torch.nn.Linear(fd, 512),
-                    torch.nn.ReLU(True),
-                    torch.nn.BatchNorm1d(512),
-                    torch.nn.Dropout(0.1),
-                    torch.nn.Linear(512, 256),
-                    torch.nn.ReLU(True),
-                    torch.nn.BatchNorm1d(256),
-                    torch.nn.Dropout(0.06),
-                    torch.nn.Linear(256, 7)
-                )
-        
-        wrong_model = TestModel()
-        wrong_model.load_state_dict(checkpoint['model_state_dict'])
-        print(f"   ❌ THIS SHOULD HAVE FAILED!")
-        
-    except Exception as e:
-        print(f"   ✅ Correctly failed (architecture mismatch)")
-        print(f"   Error: {str(e)[:100]}...")
+    # A different backbone (e.g. efficientnetv2_b2) is detected from
+    # model_name alone - no need to build it and watch the load fail
+    print("\n2. Checking checkpoint backbone name:")
+    if training_model in COMPATIBLE_MODEL_NAMES:
+        print(f"   ✓ {training_model} matches the backend backbone")
+    else:
+        print(f"   ❌ {training_model} does not match efficientnet_b2")
     
     # 4. Summary
     print("\n" + "="*70)
     print("VERIFICATION SUMMARY")
     print("="*70)
     
-    if training_model == 'efficientnet_b2' or training_model == 'tf_efficientnet_b2':
+    if training_model in COMPATIBLE_MODEL_NAMES:
         print("\n✅ CORRECT CONFIGURATION!")
         print(f"   Training model: {training_model}")
         print(f"   Backend model: efficientnet_b2 (matches)")